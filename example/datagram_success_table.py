@@ -44,31 +44,47 @@ Chance of datagram success by given data transfer size
 | 253 bytes (32 packets) | 96.8%             | 72.5%             | 19.4%             | 3.4%               | 0.1%               |
 
 """
-import sys
-try:
-    import tabulate
-except ImportError:
-    print("Error: tabulate package is needed to show table. Try:")
-    print("python3 -m pip install tabulate")
-    sys.exit(1)
+import math
+
+
+def github_table(header, rows):
+    """ Format header and rows as a GitHub flavoured markdown table """
+    # Columns are as wide as the widest cell, headers get at least 2 spaces of padding
+    widths = [len(title) + 2 for title in header]
+    for row in rows:
+        widths = [max(width, len(cell)) for width, cell in zip(widths, row)]
+
+    def format_row(cells):
+        return "| " + " | ".join(cell.ljust(width) for cell, width in zip(cells, widths)) + " |"
+
+    lines = [format_row(header)]
+    lines.append("|" + "|".join("-" * (width + 2) for width in widths) + "|")
+    lines.extend(format_row(row) for row in rows)
+    return "\n".join(lines)
+
 
 def main():
     packet_loss_rates = [0.1, 1, 5, 10, 20]
 
+    packet_counts = range(1, 33)
+
+    # Compute the full table of success chances up front, one column per packet loss rate.
+    # (1 - p) ** n is evaluated as exp(n * log1p(-p)) so the logarithm is only taken once per rate
+    columns = []
+    for drop_rate in packet_loss_rates:
+        log_packet_success = math.log1p(-drop_rate / 100.0)
+        columns.append([math.exp(num_packets * log_packet_success) * 100 for num_packets in packet_counts])
+
     data = []
-    for num_packets in range(1, 33):
+    for idx, num_packets in enumerate(packet_counts):
         datagram_size = num_packets * 8 - 3  # 3 byte overhead pr packet
-        row = ["{:<3} bytes ({:2} packets)".format(datagram_size, num_packets)]
-        for drop_rate in packet_loss_rates:
-            success = (1.0 - (drop_rate/100.0)) ** num_packets * 100
-            row.append("{:5.1f}%".format(success))
-
+        row = ("%-3d bytes (%2d packets)" % (datagram_size, num_packets),)
+        row += tuple("%.1f%%" % column[idx] for column in columns)
         data.append(row)
 
-    header = ["Datagram size"]
-    header.extend(["{:.1f}% packetloss".format(x) for x in packet_loss_rates])
+    header = ("Datagram size",) + tuple("%.1f%% packetloss" % x for x in packet_loss_rates)
     print("Chance of datagram success by given data transfer size")
-    print(tabulate.tabulate(data, headers=header, tablefmt="github"))
+    print(github_table(header, data))
 
 if __name__ == "__main__":
     main()
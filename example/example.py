@@ -74,16 +74,17 @@ def main():
         return
 
     print("Wait for packet from other modem. Ctrl-C to abort")
-    t0 = time.time()
+    queue_interval = 5.0
+    next_queue_time = time.monotonic() + queue_interval
     try:
         while True:
             pkt = modem.get_data_packet()
             if pkt:
                 print("Got:", pkt)
-            if t0 + 5 > time.time():
+            if time.monotonic() >= next_queue_time:
                 # Queue another packet after some time
                 modem.cmd_queue_packet(data)
-                t0 = time.time()
+                next_queue_time = time.monotonic() + queue_interval
 
             time.sleep(0.1)
     except KeyboardInterrupt:
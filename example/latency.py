@@ -18,6 +18,9 @@ import struct
 import argparse
 from wlmodem import WlModem
 
+# Packet layout: counter and elapsed time
+PACKET = struct.Struct("<Lf")
+
 
 def send(modem):
     """
@@ -27,19 +30,25 @@ def send(modem):
 
     print("Starting sending packets")
     counter = 0
+    update_interval = 0.05
 
-    t0 = time.time()
+    t0 = time.monotonic()
+    next_update = t0
     while True:
-        elapsed = time.time() - t0
+        elapsed = time.monotonic() - t0
         print("Updating latest value to {} after {:.1f}".format(counter, elapsed))
-        encoded = struct.pack("<Lf", counter, time.time() - t0)
+        encoded = PACKET.pack(counter, elapsed)
 
         # Update queue with latest values
-        modem.cmd_flush_queue()
-        modem.cmd_queue_packet(encoded)
-
-        # Wait for a bit before updating the latest values in the modem
-        time.sleep(0.05)
+        modem.cmd_flush_and_queue_packet(encoded)
+
+        # Wait for a bit before updating the latest values in the modem. Sleep until the next
+        # deadline so the time spent talking to the modem does not add to the update interval.
+        next_update += update_interval
+        if next_update < time.monotonic():
+            # Fell behind (ie. waiting for a modem reply), don't try to catch up with a burst of updates
+            next_update = time.monotonic()
+        time.sleep(max(0.0, next_update - time.monotonic()))
         counter += 1
 
 def receive(modem):
@@ -48,8 +57,7 @@ def receive(modem):
     while True:
         pkt = modem.get_data_packet(timeout=1.0)
         if pkt:
-            data = struct.unpack("<Lf", pkt)
-            counter, elapsed = data
+            counter, elapsed = PACKET.unpack(pkt)
             print("Got {} with time {:.1f}".format(counter, elapsed))
 
 
@@ -7,9 +7,12 @@ import logging
 import sys
 import time
 import socket
+import selectors
 import argparse
 from wlmodem import WlModem, WlUDPSocket
 
+log = logging.getLogger(__name__)
+
 
 def host_port_from_str(addr):
     parts = addr.split(":")
@@ -18,6 +21,19 @@ def host_port_from_str(addr):
     return host, port
 
 
+def set_socket_buffer_size(sock, option, size):
+    """ Request a socket buffer size (SO_RCVBUF/SO_SNDBUF) and warn if the OS gives us less """
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+    except socket.error as err:
+        print("Warning: Unable to set socket buffer size to {} bytes: {}".format(size, err))
+        return
+    actual = sock.getsockopt(socket.SOL_SOCKET, option)
+    if actual < size:
+        print("Note: Socket buffer size is {} bytes, requested {}. "
+              "On Linux the limit is raised with sysctl net.core.rmem_max/net.core.wmem_max".format(actual, size))
+
+
 def main():
     """ Demo code """
     parser = argparse.ArgumentParser(description="Water Linked Modem example")
@@ -60,9 +76,13 @@ def main():
         sys.exit(1)
 
     max_udp_size = 1024  # At 5% packet drop it is very unlikely that larger packets will transfer successfully
+    # Large socket buffers so bursts of datagrams are not dropped by the kernel between reads.
+    # The kernel caps the requested size at net.core.rmem_max/net.core.wmem_max.
+    udp_buffer_size = 12 * 1024 * 1024
     listen = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    listen.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, max_udp_size)
-    listen.settimeout(0.01)
+    listen.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    set_socket_buffer_size(listen, socket.SO_RCVBUF, udp_buffer_size)
+    listen.setblocking(False)
     _lh, _lp = host_port_from_str(args.listen)
 
     try:
@@ -73,31 +93,53 @@ def main():
         return
 
     send = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    set_socket_buffer_size(send, socket.SO_SNDBUF, udp_buffer_size)
     send_host, send_port = host_port_from_str(args.send)
-    print("Sending to {}:{}".format(send_host, send_port))
+    try:
+        # Resolve and connect once so every send skips the per-call destination lookup
+        send_addr = socket.getaddrinfo(send_host, send_port, socket.AF_INET, socket.SOCK_DGRAM)[0][4]
+        send.connect(send_addr)
+    except socket.error as err:
+        print("Could not resolve {}: {}".format(args.send, err))
+        return
+    print("Sending to {}:{}".format(*send_addr))
 
     wl_sock = WlUDPSocket(modem, tx_max=5, debug=args.verbose)
 
+    # Maximum number of UDP datagrams to read in one go before checking for data from the modem
+    recv_batch = 32
+    # Wake up to check for data from the modem at least this often (seconds)
+    modem_poll_time = 0.01
+
+    sel = selectors.DefaultSelector()
+    sel.register(listen, selectors.EVENT_READ)
+
     print("Ready. Waiting for datagram. Ctrl-C to abort")
     try:
         while True:
-            try:
-                data, addr = listen.recvfrom(max_udp_size)
-                print("Got UDP datagram from {}: {} bytes".format(addr, len(data)))
-                success = wl_sock.send(data)
-                if not success:
-                    print("Drop UDP datagram: Too many packets queued")
-            except socket.timeout:
-                pass
-
-
-            received = wl_sock.receive()
-            if received:
-                print("Got msg from modem {} bytes, sending UDP packet to {}".format(len(received), args.send))
+            # Sleep until a datagram arrives or it is time to check the modem
+            if sel.select(timeout=modem_poll_time):
+                # Drain a burst of datagrams in one pass instead of one datagram per loop
+                for _ in range(recv_batch):
+                    try:
+                        data, addr = listen.recvfrom(max_udp_size)
+                    except BlockingIOError:
+                        break
+                    log.info("Got UDP datagram from %s: %d bytes", addr, len(data))
+                    success = wl_sock.send(data)
+                    if not success:
+                        log.warning("Drop UDP datagram: Too many packets queued")
+
+            # Forward all datagrams received by the modem, not just one per loop
+            while True:
+                received = wl_sock.receive()
+                if not received:
+                    break
+                log.info("Got msg from modem %d bytes, sending UDP packet to %s", len(received), args.send)
                 try:
-                    send.sendto(received, (send_host, send_port))
+                    send.send(received)
                 except socket.error as err:
-                    print("ERROR: Unable to send UDP packet: {}".format(err))
+                    log.error("Unable to send UDP packet: %s", err)
     except KeyboardInterrupt:
         print("Aborting")
 
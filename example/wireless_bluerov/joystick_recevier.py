@@ -6,24 +6,26 @@ sends MavLink messages to control a BlueROV2.
 
 """
 from __future__ import print_function, division
+import logging
 import time
 import struct
 import sys
 from wlmodem import WlModem
 from pixhawk import Pixhawk
 
+log = logging.getLogger(__name__)
+
+# Packet layout: 4 sticks, 2 unused bytes and 2 bytes of buttons
+JOYSTICK_PACKET = struct.Struct("BBBBxxBB")
 
-def byte_to_button(val):
-    """ Convert button byte to list of values """
-    btn = []
-    for x in range(8):
-        valid = (val >> x) & 0x01
-        if valid > 0:
-            btn.append(True)
-        else:
-            btn.append(False)
 
-    return btn
+# Button states for every possible button byte, bit 0 first
+BUTTONS = tuple(tuple(bool((val >> x) & 0x01) for x in range(8)) for val in range(256))
+
+
+def byte_to_button(val):
+    """ Convert button byte to tuple of values """
+    return BUTTONS[val]
 
 
 def byte_to_pwm(bytevalue):
@@ -38,6 +40,14 @@ def byte_to_pwm(bytevalue):
     return int(scaled) + 1500 #  Range: 1100 - 1900
 
 
+# PWM value for every possible stick byte
+PWM = tuple(byte_to_pwm(val) for val in range(256))
+# PWM value when the stick is centered
+NEUTRAL_PWM = PWM[127]
+# All stick channels centered
+NEUTRAL_CHANNELS = {3: NEUTRAL_PWM, 4: NEUTRAL_PWM, 5: NEUTRAL_PWM, 6: NEUTRAL_PWM}
+
+
 def run(modem, pix):
     print("Waiting for modem packets")
     timeout_max = 5
@@ -47,8 +57,8 @@ def run(modem, pix):
         if pkt:
             timeout_cnt = timeout_max
             #print("Got data: {}".format(pkt))
-            joystick = struct.unpack("BBBBxxBB", pkt)
-            print("Got joystick data {}".format(joystick))
+            joystick = JOYSTICK_PACKET.unpack_from(pkt)
+            log.debug("Got joystick data %s", joystick)
             leftX, leftY, rightX, rightY, b_pads1, b_pads2 = joystick
             #print(leftX, leftY, rightX, rightY)
             pads1 = byte_to_button(b_pads1)
@@ -64,10 +74,7 @@ def run(modem, pix):
             if y:
                 pix.change_mode("STABILIZE")
 
-            pix.set_rc_channel_pwm(4, byte_to_pwm(leftX))
-            pix.set_rc_channel_pwm(3, byte_to_pwm(leftY))
-            pix.set_rc_channel_pwm(6, byte_to_pwm(rightX))
-            pix.set_rc_channel_pwm(5, byte_to_pwm(rightY))
+            pix.set_rc_channels_pwm({4: PWM[leftX], 3: PWM[leftY], 6: PWM[rightX], 5: PWM[rightY]})
 
             arm = pads2[0]
             disarm = pads2[1]
@@ -79,10 +86,7 @@ def run(modem, pix):
                 pix.disarm()
         else:
             # Got no packet, lets stop movement
-            pix.set_rc_channel_pwm(4, byte_to_pwm(127))
-            pix.set_rc_channel_pwm(3, byte_to_pwm(127))
-            pix.set_rc_channel_pwm(6, byte_to_pwm(127))
-            pix.set_rc_channel_pwm(5, byte_to_pwm(127))
+            pix.set_rc_channels_pwm(NEUTRAL_CHANNELS)
 
             timeout_cnt -= 1
             if timeout_cnt < 0:
@@ -101,8 +105,14 @@ def main():
     parser.add_argument('-r', '--role', action="store", type=str, default="b", help="Role: a or b.")
     parser.add_argument('-c', '--channel', action="store", type=int, default=4, help="Channel: 1-7.")
     parser.add_argument('-m', '--mavlink', action="store", type=str, default="udpout:0.0.0.0:9000", help="Mavlink connection to use")
+    parser.add_argument('-v' , '--verbose', action="store_true", help="Verbose.")
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.WARN)
+    if args.verbose:
+        # Only this script's per-packet messages, not the modem protocol debug output
+        log.setLevel(logging.DEBUG)
+
     ch = args.channel
     if ch < 1 or ch > 7:
         print("Error: invalid channel: {}".format(ch))
@@ -11,31 +11,41 @@ Download the xbox controller script with:
 wget https://raw.githubusercontent.com/FRC4564/Xbox/master/xbox.py
 
 """
+import logging
 import time
 import struct
 import sys
 import xbox
 from wlmodem import WlModem
 
+log = logging.getLogger(__name__)
 
-def button_to_byte(tpl):
-    """ Convert button tuple to byte """
-    return sum([v<<k for k,v in enumerate(tpl)])
+# Packet layout: 4 sticks, 2 unused bytes and 2 bytes of buttons
+JOYSTICK_PACKET = struct.Struct("BBBBxxBB")
+
+
+# Button byte for every combination of up to 8 button states (0/1 or False/True), first button in bit 0
+BUTTON_BYTES = dict(
+    (tuple((byte >> k) & 0x01 for k in range(length)), byte)
+    for length in range(1, 9)
+    for byte in range(1 << length)
+)
 
 
-def clamp(val, min, max):
-    """ Clamp value between min/max values """
-    if val > max:
-        return max
-    if val < min:
-        return min
-    return val
+def button_to_byte(tpl):
+    """ Convert button tuple to byte """
+    try:
+        return BUTTON_BYTES[tpl]
+    except (KeyError, TypeError):
+        # Not a tuple of 0/1 values
+        return sum([v<<k for k,v in enumerate(tpl)])
 
 
 def stick_to_byte(val):
     """" Convert float -1 to 1 to byte (0-255) """
     adjusted = int((val+1.0)/2.0 * 255)
-    return clamp(adjusted, 0, 255)
+    # Clamp to 0-255
+    return max(0, min(255, adjusted))
 
 
 def run(joy, modem):
@@ -43,7 +53,7 @@ def run(joy, modem):
     while True:
         sticks = (joy.leftX(), joy.leftY(), joy.rightX(), joy.rightY())
 
-        stickbytes = [stick_to_byte(x) for x in sticks]
+        stickbytes = tuple(stick_to_byte(x) for x in sticks)
 
         pads1 = (joy.dpadUp(), joy.dpadRight(), joy.dpadDown(), joy.dpadLeft(), joy.A(), joy.B(), joy.X(), joy.Y())
         pads2 = (joy.Start(), joy.Back())
@@ -51,14 +61,12 @@ def run(joy, modem):
         pads1byte = button_to_byte(pads1)
         pads2byte = button_to_byte(pads2)
 
-        all_bytes = stickbytes
-        all_bytes.extend([pads1byte, pads2byte])
-        print("Sending values: {}".format(all_bytes))
-        encoded = struct.pack("BBBBxxBB", *all_bytes)
+        all_bytes = stickbytes + (pads1byte, pads2byte)
+        log.debug("Sending values: %s", all_bytes)
+        encoded = JOYSTICK_PACKET.pack(*all_bytes)
 
         # Update queue with latest joystick values
-        modem.cmd_flush_queue()
-        modem.cmd_queue_packet(encoded)
+        modem.cmd_flush_and_queue_packet(encoded)
 
         time.sleep(0.05)
 
@@ -69,8 +77,14 @@ def main():
     parser.add_argument('-D', '--device', action="store", required=True, type=str, help="Serial port.")
     parser.add_argument('-r', '--role', action="store", type=str, default="a", help="Role: a or b.")
     parser.add_argument('-c', '--channel', action="store", type=int, default=4, help="Channel: 1-7.")
+    parser.add_argument('-v' , '--verbose', action="store_true", help="Verbose.")
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.WARN)
+    if args.verbose:
+        # Only this script's per-packet messages, not the modem protocol debug output
+        log.setLevel(logging.DEBUG)
+
     ch = args.channel
     if ch < 1 or ch > 7:
         print("Error: invalid channel: {}".format(ch))
@@ -4,6 +4,9 @@ from pymavlink import mavutil
 
 
 class Pixhawk():
+    # RC channel value meaning "leave this channel unchanged" in RC_CHANNELS_OVERRIDE
+    RC_CHANNELS_UNCHANGED = (65535,) * 8
+
     def __init__(self, url='udpout:0.0.0.0:9000'):
         print("Starting set up")
 
@@ -16,6 +19,9 @@ class Pixhawk():
 
         self._check_conn()
 
+        # Available modes do not change after connecting, so only look them up once
+        self._mode_mapping = self.master.mode_mapping()
+
     def disarm(self):
         """
         Disarm the Pixhawk
@@ -45,15 +51,13 @@ class Pixhawk():
 
         mode (string): New mode of Pixhawk
         """
-        # Check if mode is available
-        if mode not in self.master.mode_mapping():
+        # Get mode ID and check if mode is available
+        mode_id = self._mode_mapping.get(mode)
+        if mode_id is None:
             print('Unknown mode : {}'.format(mode))
-            print('Try:', list(self.master.mode_mapping().keys()))
+            print('Try:', list(self._mode_mapping.keys()))
             exit(1)
 
-        # Get mode ID
-        mode_id = self.master.mode_mapping()[mode]
-
         self.master.mav.set_mode_send(
             self.master.target_system,
             mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED,
@@ -114,9 +118,28 @@ class Pixhawk():
         # We only have 8 channels
         # http://mavlink.org/messages/common#RC_CHANNELS_OVERRIDE
         if id < 8:
-            rc_channel_values = [65535 for _ in range(8)]
-            rc_channel_values[id - 1] = pwm
+            unchanged = self.RC_CHANNELS_UNCHANGED
+            rc_channel_values = unchanged[:id - 1] + (pwm,) + unchanged[id:]
             self.master.mav.rc_channels_override_send(
                 self.master.target_system,                # target_system
                 self.master.target_component,             # target_component
                 *rc_channel_values)                  # RC channel list, in microseconds.
+
+    def set_rc_channels_pwm(self, channels):
+        """
+        Set pwm value of multiple RC channels with a single message
+        channels (dict): Channel ID to channel pwm value 1100-1900, see set_rc_channel_pwm
+
+        Channels not given are left unchanged.
+        """
+        rc_channel_values = list(self.RC_CHANNELS_UNCHANGED)
+        for channel, pwm in channels.items():
+            if channel < 1 or channel > 8:
+                print("Channel {} does not exist.".format(channel))
+                return
+            rc_channel_values[channel - 1] = pwm
+
+        self.master.mav.rc_channels_override_send(
+            self.master.target_system,                # target_system
+            self.master.target_component,             # target_component
+            *rc_channel_values)                  # RC channel list, in microseconds.
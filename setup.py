@@ -14,8 +14,6 @@ classifiers = [
     "Intended Audience :: Developers",
     "License :: OSI Approved :: MIT License",
     "Programming Language :: Python",
-    "Programming Language :: Python :: 2",
-    "Programming Language :: Python :: 2.7",
     "Programming Language :: Python :: 3",
     "Programming Language :: Python :: 3.6",
     "Programming Language :: Python :: 3.7",
@@ -32,7 +30,6 @@ long_description = (
 requires = [
     'setuptools',
     'pyserial',
-    'crcmod',
     'cobs',
 ]
 
@@ -52,6 +49,7 @@ setup(name='wlmodem',
       packages=['wlmodem'],
       data_files=[],
       install_requires=requires,
+      python_requires='>=3.6',
       include_package_data=True,
       extras_require=extras_require,
 )
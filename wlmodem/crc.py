@@ -0,0 +1,32 @@
+# encoding=utf-8
+"""
+CRC-8 checksum used by the Water Linked Modem protocol and datagram transport
+"""
+
+# CRC-8 parameters, same as the "crc-8" predefined in crcmod: poly 0x07, init 0, not reflected, no xor out
+CRC8_POLY = 0x07
+
+
+def _make_crc8_table(poly):
+    """ Build the byte-at-a-time lookup table for the given polynomial """
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ poly) & 0xff
+            else:
+                crc = (crc << 1) & 0xff
+        table.append(crc)
+    return tuple(table)
+
+
+CRC8_TABLE = _make_crc8_table(CRC8_POLY)
+
+
+def crc8(data, table=CRC8_TABLE):
+    """ Calculate the CRC-8 of data (bytes or bytearray) """
+    crc = 0
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
@@ -5,26 +5,24 @@ Water Linked Modem protocol parser
 from __future__ import print_function, division
 import logging
 import time
-import sys
+from collections import deque
 import serial
-import crcmod
+from .crc import crc8
 
 
 # Logger
-log = logging.getLogger(__file__)
-
-# Python2 detection
-IS_PY2 = False
-if sys.version_info < (3, 0):
-    IS_PY2 = True
-
+log = logging.getLogger(__name__)
 
 # Protocol definitions
 SOP = ord('w')
 EOP = ord('\n')
+EOP_CR = ord('\r')  # \r is also accepted as EOP
 DIR_CMD = ord('c')
 DIR_RESP = ord('r')
 CHECKSUM = ord('*')
+COMMA = ord(',')
+COMMA_BYTES = b','
+DIGIT_0 = ord('0')
 
 CMD_GET_VERSION = ord('v')
 CMD_GET_PAYLOAD_SIZE = ord('n')
@@ -35,7 +33,8 @@ CMD_SET_SETTINGS = ord('s')
 CMD_QUEUE_PACKET = ord('q')
 CMD_FLUSH = ord('f')
 RESP_GOT_PACKET = ord('p')
-ALL_VALID = [
+BINARY_PREFIX_LEN = 6  # Length of the sentence start before a binary payload, for example: 'wcq,8,'
+ALL_VALID = frozenset([
     CMD_GET_VERSION,
     CMD_GET_PAYLOAD_SIZE,
     CMD_GET_BUFFER_LENGTH,
@@ -45,20 +44,29 @@ ALL_VALID = [
     CMD_QUEUE_PACKET,
     CMD_FLUSH,
     RESP_GOT_PACKET,
-]
+])
+# Commands with a binary payload
+BINARY_CMDS = frozenset([CMD_QUEUE_PACKET, RESP_GOT_PACKET])
+
+# Checksum field for every possible checksum, for example: b'*44'
+CHECKSUM_FIELDS = tuple(b"*%02x" % csum for csum in range(256))
 
 
 def is_eop(ch):
-    """ Is the given byte an eop """
-    return ch in (b'\n', b'\r')
+    """ Is the given byte (int) an eop """
+    return ch == EOP or ch == EOP_CR
+
+
+def find_eop(data, start=0):
+    """ Find the index of the first eop in data from start. Returns -1 if there is none """
+    nl_idx = data.find(b'\n', start)
+    # Only look for \r before the \n
+    cr_idx = data.find(b'\r', start, len(data) if nl_idx < 0 else nl_idx)
+    return nl_idx if cr_idx < 0 else cr_idx
 
 
 def is_checksum(ch):
-    """ Is the given byte an checksum char """
-    #print(type(ch), ch, chr(ch))
-    #print("Checksum ", type(CHECKSUM), ord(CHECKSUM), CHECKSUM)
-    if isinstance(ch, bytes):
-        return ord(ch) == CHECKSUM
+    """ Is the given byte (int) an checksum char """
     return ch == CHECKSUM
 
 
@@ -70,20 +78,17 @@ def is_ack(ch):
 def get_binary_payload_size(sentence):
     """ Detect if this is the start of a binary payload and return the number of bytes it contains """
     # For example: 'wcq,8,'
-    if len(sentence) != 6:
-        return -1
-    if sentence[0] != SOP:
+    if len(sentence) != BINARY_PREFIX_LEN:
         return -1
-    if sentence[2] not in [CMD_QUEUE_PACKET, RESP_GOT_PACKET]:
+    if sentence[0] != SOP or sentence[2] not in BINARY_CMDS:
         return -1
-    fragments = sentence.split(b',', 2)  # Split on comma, but don't touch the binary data
-    if len(fragments) < 2:
-        return -1
-    try:
-        _len = int(fragments[1])
-        return _len
-    except ValueError:
+    if sentence[3] != COMMA or sentence[5] != COMMA:
         return -1
+    # Single digit size between the commas, no need to split the sentence
+    digit = sentence[4] - DIGIT_0
+    if 0 <= digit <= 9:
+        return digit
+    return -1
 
 
 class WlModemGenericError(Exception):
@@ -100,6 +105,8 @@ class WlProtocolChecksumError(WlProtocolParseError):
 
 class ModemSentence(object):
     """ ModemSentence represents a message to/from the modem """
+    __slots__ = ("cmd", "dir", "options")
+
     def __init__(self, cmd, direction, options=None):
         self.cmd = cmd
         self.dir = direction
@@ -115,30 +122,22 @@ class WlProtocolParser(object):
     Water Linked Modem protocol parser
     """
     def __init__(self):
-        self.crc_func = None
-        self.crc_func = crcmod.predefined.mkPredefinedCrcFun("crc-8")
+        self.crc_func = crc8
 
     @staticmethod
     def do_format_checksum(checksum):
-        if IS_PY2:
-            return bytes("*{:02x}".format(checksum))
-
-        return bytes("*{:02x}".format(checksum), "ascii")
+        return CHECKSUM_FIELDS[checksum]
 
     def checksum_for_buffer(self, data):
-        if IS_PY2:
-            csum = self.crc_func(bytes(data))
-        else:
-            csum = self.crc_func(data)
-        return self.do_format_checksum(csum)
+        return self.do_format_checksum(self.crc_func(data))
 
     def do_frame_fragments(self, cmd, direction, options, checksum):
         """ Frame response. Direction (c/r). Options are optional. """
-        resp = bytearray([SOP, direction, cmd])
+        resp = bytearray((SOP, direction, cmd))
 
         if options:
-            resp.append(ord(","))
-            resp.extend(b",".join(options))
+            resp.append(COMMA)
+            resp += COMMA_BYTES.join(options)
 
         csum = b""
         if checksum:
@@ -149,14 +148,12 @@ class WlProtocolParser(object):
         if isinstance(cmd, bytes):
             cmd = cmd[0]
         resp, csum = self.do_frame_fragments(cmd, direction, options, checksum)
-        resp.extend(csum)
+        resp += csum
         resp.append(EOP)
         return resp
 
     def parse(self, sentence):
         sop = sentence[0]
-        if isinstance(sop, bytes):
-            sop = ord(sop)
         if sop != SOP:
             # This will swallow LF following a CR and garbage
             raise WlProtocolParseError("Missing SOP: Got {} Expected {}".format(sop, SOP))
@@ -164,25 +161,19 @@ class WlProtocolParser(object):
             raise WlProtocolParseError("Sentence is too short")
 
         direction = sentence[1]
-        if isinstance(direction, bytes):
-            direction = ord(direction)
         if direction not in [DIR_CMD, DIR_RESP]:
             raise WlProtocolParseError("Invalid direction {}: {}".format(direction, sentence))
 
-        got_checksum = is_checksum(sentence[-3])
-        csum = ""
-        if got_checksum:
+        if is_checksum(sentence[-3]):
             csum = sentence[-3:]
             sentence = sentence[:-3]  # Remove checksum to ease further processing
-            if csum != self.checksum_for_buffer(sentence):
-                expect = self.checksum_for_buffer(sentence)
+            expect = self.checksum_for_buffer(sentence)
+            if csum != expect:
                 raise WlProtocolChecksumError("Expected {} got {}".format(expect, csum))
 
         cmd = sentence[2]
-        if isinstance(cmd, bytes):
-            cmd = ord(cmd)
         if cmd in ALL_VALID:
-            if cmd in [CMD_QUEUE_PACKET, RESP_GOT_PACKET]:
+            if cmd in BINARY_CMDS:
                 # Payload is binary, so only split until payload
                 fragments = sentence.split(b',', 2)
             else:
@@ -209,9 +200,11 @@ class WlModemBase(object):
 
         self._holdoff = 0
         self._buffer = bytearray()
+        self._rx_pending = b""  # Data read from the device, but not yet parsed
+        self._rx_pending_pos = 0  # Start of the unparsed data in _rx_pending
         self.debug = debug
 
-        self._rx_queue = list()
+        self._rx_queue = deque()
 
     # --------------------
     # Public API functions
@@ -224,13 +217,13 @@ class WlModemBase(object):
         try:
             version = self.cmd_get_version()
         except WlProtocolParseError as err:
-            log.warning("Connect error: {}".format(err))
+            log.warning("Connect error: %s", err)
             version = None
         if not version:
             log.error("Timeout/error connecting to modem")
             return False
         if version[0] != 1:
-            log.warning("Unsupported major version {}".format(version))
+            log.warning("Unsupported major version %s", version)
             return False
 
         version = ".".join([str(x) for x in version])
@@ -240,7 +233,7 @@ class WlModemBase(object):
         try:
             payload = self.cmd_get_payload_size()
         except WlProtocolParseError as err:
-            log.warning("Get payload error: {}".format(err))
+            log.warning("Get payload error: %s", err)
             payload = None
         if not payload:
             log.warning("Timeout getting payload size")
@@ -259,7 +252,7 @@ class WlModemBase(object):
         try:
             version = [int(x) for x in pkt.options]
         except (TypeError, ValueError):
-            log.warning("Version number is invalid: {}".format(pkt.options))
+            log.warning("Version number is invalid: %s", pkt.options)
             return None
         return version
 
@@ -273,23 +266,28 @@ class WlModemBase(object):
 
     def cmd_queue_packet(self, data):
         """ Queue a data packet for transmission. Data must be of type bytes or bytearray """
-        if self.payload_size < 1:
-            raise WlModemGenericError("Connect before queueing data")
-        # Anyone has a way of checking for bytes which supports duck-typing?
-        # The suggestion from https://stackoverflow.com/a/34870210 doesn't seem to work in Python 3
-        if not isinstance(data, (bytes, bytearray)):
-            raise WlModemGenericError("Please encode data as bytes")
-        if len(data) != self.payload_size:
-            raise WlModemGenericError("Invalid payload size {} expected {}".format(len(data), self.payload_size))
-        if IS_PY2:
-            _size = bytes("{}".format(self.payload_size))
-        else:
-            _size = bytes("{}".format(self.payload_size), "ascii")
-        pkt = self.request(CMD_QUEUE_PACKET, options=[_size, data])
+        pkt = self.request(CMD_QUEUE_PACKET, options=self._queue_packet_options(data))
         if pkt:
             return is_ack(pkt.options[0])
         return False
 
+    def cmd_flush_and_queue_packet(self, data, timeout=0.5):
+        """
+        Flush the transmit queue and queue a data packet for transmission, ie. replace any queued
+        packets with this one. Data must be of type bytes or bytearray.
+
+        Both commands are sent before waiting for the responses, which saves a round-trip
+        compared to calling cmd_flush_queue and cmd_queue_packet.
+        Returns True if both commands are acknowledged.
+        """
+        options = self._queue_packet_options(data)
+        self._write(self.parser.do_frame(CMD_FLUSH) + self.parser.do_frame(CMD_QUEUE_PACKET, options=options))
+        flushed = self.wait_sentence(CMD_FLUSH, timeout=timeout)
+        queued = self.wait_sentence(CMD_QUEUE_PACKET, timeout=timeout)
+        if flushed and queued:
+            return is_ack(flushed.options[0]) and is_ack(queued.options[0])
+        return False
+
     def get_data_packet(self, timeout=5):
         """
         Get data packet from another modem.
@@ -298,7 +296,7 @@ class WlModemBase(object):
         If no packet is available None is returned
         """
         if self._rx_queue:
-            pkt = self._rx_queue.pop(0)
+            pkt = self._rx_queue.popleft()
             return pkt.options[1]
         if timeout > 0:
             # Got a timeout
@@ -317,7 +315,7 @@ class WlModemBase(object):
         role = role.encode()
         if channel < 1 or channel > 7:
             raise WlModemGenericError("Invalid channel {}".format(channel))
-        channel = "{:d}".format(channel).encode()
+        channel = b"%d" % channel
         pkt = self.request(CMD_SET_SETTINGS, options=[role, channel], timeout=timeout)
         if pkt:
             # Return success if we get an acknowledge
@@ -357,27 +355,38 @@ class WlModemBase(object):
     # ----------------------------------
     # Lower level and internal functions
     # ----------------------------------
-    def _dbg(self, *args, **kwargs):
-        if self.debug:
-            log.debug(*args, **kwargs)
-            #print(*args, **kwargs)
+    def _dbg(self, msg, *args):
+        # Arguments are only formatted if the debug message is actually logged
+        if self.debug and log.isEnabledFor(logging.DEBUG):
+            log.debug(msg, *args)
 
     def send_reset(self):
         """ Send newline to ensure we start fresh with the modem """
-        if IS_PY2:
-            self._write(chr(EOP))  # Reset in case there is something in the buffer
-        else:
-            self._write(bytes([EOP]))  # Reset in case there is something in the buffer
+        self._write(bytes([EOP]))  # Reset in case there is something in the buffer
 
     def request(self, cmd_id, options=None, timeout=0.5):
         """ Send a request and wait for the response """
         self._write(self.parser.do_frame(cmd_id, options=options))
         return self.wait_sentence(cmd_id, timeout=timeout)
 
+    def _queue_packet_options(self, data):
+        """ Check data packet can be queued and return the options for the queue command """
+        if self.payload_size < 1:
+            raise WlModemGenericError("Connect before queueing data")
+        # Anyone has a way of checking for bytes which supports duck-typing?
+        # The suggestion from https://stackoverflow.com/a/34870210 doesn't seem to work in Python 3
+        if not isinstance(data, (bytes, bytearray)):
+            raise WlModemGenericError("Please encode data as bytes")
+        if len(data) != self.payload_size:
+            raise WlModemGenericError("Invalid payload size {} expected {}".format(len(data), self.payload_size))
+        return [b"%d" % self.payload_size, data]
+
     def wait_sentence(self, resp_id, timeout=5.0, sleep_time=0.001):
         """ Wait for a specific response from modem """
-        start = time.time()
-        while time.time() - start < timeout:
+        # Monotonic clock so the timeout is not affected by changes to the system time
+        monotonic = time.monotonic
+        deadline = monotonic() + timeout
+        while monotonic() < deadline:
             msg = self.get_packet()
             if msg:
                 if msg.cmd == resp_id:
@@ -386,7 +395,8 @@ class WlModemBase(object):
                     # Got a data packet while waiting for another sentence
                     # Queue it so we don't loose it
                     self._rx_queue.append(msg)
-            if sleep_time:
+            elif sleep_time and self._iodev.in_waiting == 0:
+                # Only sleep when there is nothing more to read
                 time.sleep(sleep_time)
         return None
 
@@ -399,76 +409,97 @@ class WlModemBase(object):
         If packet decoding fails raise WlProtocolParseError
         If packet checksum is incorret raise WlProtocolChecksumError
         """
-        is_done = False
-        while self._iodev.in_waiting > 0:
-            data = self._iodev.read(1)
-
-            if len(data) < 1:
-                # This should not happen since in_waiting is > 0, but let's be safe
-                continue
-
-            if len(self._buffer) == 0 and len(data) == 1 and is_eop(data):
-                # Swallow newline when buffer is empty to allow both \n and \r\n
-                self._dbg("swallow {}".format(data))
-                continue
-
-            if self._holdoff > 0:
-                self._buffer.append(ord(data))
-                self._holdoff -= len(data)
-                self._dbg("holdoff {} {}".format(self._holdoff, self._buffer))
-            elif is_eop(data):
-                # We got an EOP, we swallow it and parse the data
-                self._dbg("eop")
-                is_done = True
-            else:
-                self._buffer.append(ord(data))
-                self._dbg("add {}".format(self._buffer))
+        while True:
+            chunk, pos = self._read_chunk()
+            end = len(chunk)
+            if pos >= end:
+                # Haven't gotten a full packet yet
+                return None
+
+            while pos < end:
+                if self._holdoff > 0:
+                    # Binary payload, take it as is
+                    take = min(self._holdoff, end - pos)
+                    self._buffer += chunk[pos:pos + take]
+                    self._holdoff -= take
+                    pos += take
+                    self._dbg("holdoff %s %s", self._holdoff, self._buffer)
+                    continue
+
+                if len(self._buffer) == 0 and is_eop(chunk[pos]):
+                    # Swallow newline when buffer is empty to allow both \n and \r\n
+                    self._dbg("swallow %s", chunk[pos])
+                    pos += 1
+                    continue
+
+                eop = find_eop(chunk, pos)
+                stop = end if eop < 0 else eop
+                if len(self._buffer) < BINARY_PREFIX_LEN:
+                    # Stop where a binary payload prefix would be complete, so it is detected before the payload
+                    stop = min(stop, pos + BINARY_PREFIX_LEN - len(self._buffer))
+                self._buffer += chunk[pos:stop]
+                pos = stop
+                self._dbg("add %s", self._buffer)
 
-            if self._holdoff == 0:
                 _size = get_binary_payload_size(self._buffer)
                 if _size > 0:
                     # We have a binary payload, next bytes must be parsed as binary
                     self._holdoff = _size
+                    continue
 
-            if self._holdoff > 0:
-                # Need more data before we have a full packet
-                continue
-
-            if not is_done:
-                # Don't have EOP yet, need more data
-                self._dbg("more please")
-                continue
-
-            try:
-                self._dbg("parse {}".format(self._buffer))
-                packet = self.parser.parse(self._buffer)
-                # Got packet, return it
-                self._reset_buffer()
-                self._dbg("parse success {}".format(packet))
-                return packet
-            except WlProtocolChecksumError as err:
-                self._dbg("checksum error {}: {}".format(self._buffer, err))
-                self._reset_buffer()
-                raise
-            except WlProtocolParseError as err:
-                # Malformed
-                self._dbg("malformed {}: {}".format(self._buffer, err))
-                self._reset_buffer()
-                raise
-
-        # Haven't gotten a full packet yet
-        return None
+                if pos != eop:
+                    # Don't have EOP yet, need more data
+                    self._dbg("more please")
+                    continue
+
+                # We got an EOP, we swallow it and parse the data. Keep the chunk and where to continue for the next call
+                self._dbg("eop")
+                self._rx_pending = chunk
+                self._rx_pending_pos = pos + 1
+                try:
+                    self._dbg("parse %s", self._buffer)
+                    packet = self.parser.parse(self._buffer)
+                    # Got packet, return it
+                    self._reset_buffer()
+                    self._dbg("parse success %s", packet)
+                    return packet
+                except WlProtocolChecksumError as err:
+                    self._dbg("checksum error %s: %s", self._buffer, err)
+                    self._reset_buffer()
+                    raise
+                except WlProtocolParseError as err:
+                    # Malformed
+                    self._dbg("malformed %s: %s", self._buffer, err)
+                    self._reset_buffer()
+                    raise
+
+    def _read_chunk(self):
+        """ Get data left over from the previous call, or else all data waiting in the serial buffer.
+
+        Returns the chunk and the position to start parsing from.
+        """
+        chunk, pos = self._rx_pending, self._rx_pending_pos
+        self._rx_pending, self._rx_pending_pos = b"", 0
+        if pos < len(chunk):
+            # Continue from the offset instead of copying the rest of the chunk for every sentence
+            return chunk, pos
+        waiting = self._iodev.in_waiting
+        if waiting > 0:
+            # Read everything in one go instead of one byte at a time
+            return self._iodev.read(waiting), 0
+        return b"", 0
 
     def _write(self, data):
         """ Write data to serial port """
-        self._dbg("Write {} {}".format(data, type(data)))
+        self._dbg("Write %s %s", data, type(data))
         return self._iodev.write(data)
 
     def _reset_buffer(self):
         """ Reset internal buffer """
         self._dbg("Reset")
         self._holdoff = 0
-        self._buffer = bytearray()
+        # Truncate in place to reuse the buffer, the parsed sentence does not refer to it
+        self._buffer.clear()
 
 
 class WlModem(WlModemBase):
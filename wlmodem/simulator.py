@@ -4,6 +4,7 @@ Water Linked Modem simulator
 """
 from __future__ import print_function, division
 import time
+from collections import deque
 from .protocol import WlModemBase
 from .protocol import CMD_FLUSH, CMD_GET_BUFFER_LENGTH, CMD_GET_DIAGNOSTIC, CMD_GET_VERSION
 from .protocol import CMD_GET_PAYLOAD_SIZE, CMD_SET_SETTINGS, CMD_QUEUE_PACKET
@@ -22,21 +23,15 @@ class MockIODev():
         return len(self.in_buf)
 
     def read(self, n):
-        if self.in_buf:
-            buf = bytearray()
-            buf.append(self.in_buf.pop(0))
-            return bytes(buf)
+        buf = bytes(self.in_buf[:n])
+        del self.in_buf[:n]
+        return buf
 
     def write(self, data):
-        if isinstance(data, bytearray):
-            self.out_buf.extend(data)
-        else:
-            for ch in data:
-                self.out_buf.append(ch)
+        self.out_buf.extend(data)
 
     def feed(self, data):
-        for x in bytes(data):
-            self.in_buf.append(x)
+        self.in_buf.extend(data)
 
     @property
     def port(self):
@@ -50,18 +45,18 @@ class WlModemSimulator(WlModemBase):
     def __init__(self, link_up_duration=3.0, queue_duration=1.0, next_duration=1.0):
         dev = MockIODev(b"")
         super(WlModemSimulator, self).__init__(dev)
-        self.tx_queue = list()
+        self.tx_queue = deque()
 
         self._link_up_duration = link_up_duration  # Time 
         self._packet_queue_duration = queue_duration
         self._next_packet_duration = next_duration
 
         self.sent = 0
-        self._link_up_time = time.time()
-        self._next_packet_time = time.time() + self._next_packet_duration
+        self._link_up_time = time.monotonic()
+        self._next_packet_time = time.monotonic() + self._next_packet_duration
 
     def _is_link_up(self):
-        return self._link_up_time < time.time()
+        return self._link_up_time < time.monotonic()
 
     def request(self, cmd_id, options=None, timeout=0.5):
         """ Send a request and wait for the response """
@@ -71,15 +66,13 @@ class WlModemSimulator(WlModemBase):
         elif cmd_id == CMD_GET_PAYLOAD_SIZE:
             return ModemSentence(cmd_id, DIR_RESP, options=[b'8'])
         elif cmd_id == CMD_GET_BUFFER_LENGTH:
-            _len = len(self.tx_queue)
-            _b = "{}".format(_len).encode("ascii")
-            return ModemSentence(cmd_id, DIR_RESP, options=[_b])
+            _len = b"%d" % len(self.tx_queue)
+            return ModemSentence(cmd_id, DIR_RESP, options=[_len])
         elif cmd_id == CMD_FLUSH:
-            # self.tx_queue.clear() # Python 3
-            self.tx_queue = list()  # Clear list Python 2 and 3
+            self.tx_queue.clear()
             return ModemSentence(cmd_id, DIR_RESP, options=[b'a'])
         elif cmd_id == CMD_SET_SETTINGS:
-            self._link_up_time = time.time() + self._link_up_duration
+            self._link_up_time = time.monotonic() + self._link_up_duration
             return ModemSentence(cmd_id, DIR_RESP, options=[b'a'])
         elif cmd_id == CMD_GET_DIAGNOSTIC:
             link_up = b'y' if self._is_link_up() else b'n'
@@ -89,12 +82,17 @@ class WlModemSimulator(WlModemBase):
             return ModemSentence(cmd_id, DIR_RESP, options=[b'a'])
         return None
 
+    def cmd_flush_and_queue_packet(self, data, timeout=0.5):
+        """ Flush the transmit queue and queue a data packet for transmission """
+        flushed = self.cmd_flush_queue(timeout=timeout)
+        return self.cmd_queue_packet(data) and flushed
+
     def get_data_packet(self, timeout=5):
         if self.tx_queue and self._is_link_up():
-            if time.time() > self._next_packet_time:
-                self._next_packet_time = time.time() + self._next_packet_duration
+            if time.monotonic() > self._next_packet_time:
+                self._next_packet_time = time.monotonic() + self._next_packet_duration
                 self.sent += 1
-                pkt = self.tx_queue.pop(0)
+                pkt = self.tx_queue.popleft()
                 return self.transform(pkt)
 
         time.sleep(timeout)
@@ -0,0 +1,33 @@
+""" Unittest """
+import os
+import unittest
+from wlmodem.crc import crc8
+
+try:
+    import crcmod
+except ImportError:
+    crcmod = None
+
+
+class TestCrc8(unittest.TestCase):
+    def test_check_value(self):
+        # Standard check value for CRC-8 (poly 0x07, init 0)
+        self.assertEqual(crc8(b"123456789"), 0xf4)
+
+    def test_empty_buffer(self):
+        self.assertEqual(crc8(b""), 0)
+
+    def test_bytes_and_bytearray_give_same_result(self):
+        data = b"wrv,1,0,1"
+        self.assertEqual(crc8(data), crc8(bytearray(data)))
+
+    def test_known_protocol_checksum(self):
+        # Checksum from a modem response, see test_protocol
+        self.assertEqual(crc8(b"wrv,1,0,1"), 0x44)
+
+    @unittest.skipIf(crcmod is None, "crcmod not installed")
+    def test_same_result_as_crcmod(self):
+        crcmod_crc8 = crcmod.predefined.mkPredefinedCrcFun("crc-8")
+        for length in range(0, 300, 7):
+            data = os.urandom(length)
+            self.assertEqual(crc8(data), crcmod_crc8(data))
@@ -1,8 +1,9 @@
 """ Unittest """
+import time
 import unittest
-import sys
 from wlmodem.protocol import WlProtocolParser, WlModemBase, ModemSentence, CMD_GET_VERSION
 from wlmodem.protocol import WlModemGenericError, WlProtocolChecksumError, WlProtocolParseError
+from wlmodem.protocol import find_eop, get_binary_payload_size
 from wlmodem.simulator import MockIODev
 
 class TestProtoParser(unittest.TestCase):
@@ -45,6 +46,22 @@ class TestProtoParser(unittest.TestCase):
         with self.assertRaises(WlProtocolParseError):
             parser.parse(b'zrv')
 
+    def test_find_eop(self):
+        self.assertEqual(find_eop(b"wcv\n"), 3)
+        self.assertEqual(find_eop(b"wcv\r\n"), 3)
+        self.assertEqual(find_eop(b"wcv\nwcv\r"), 3)
+        self.assertEqual(find_eop(b"wcv\nwcv\r", 4), 7)
+        self.assertEqual(find_eop(b"wcv"), -1)
+
+    def test_get_binary_payload_size(self):
+        self.assertEqual(get_binary_payload_size(b"wcq,8,"), 8)
+        self.assertEqual(get_binary_payload_size(bytearray(b"wrp,8,")), 8)
+        self.assertEqual(get_binary_payload_size(b"wcq,8"), -1)
+        self.assertEqual(get_binary_payload_size(b"wcq,8,1"), -1)
+        self.assertEqual(get_binary_payload_size(b"wcv,8,"), -1)
+        self.assertEqual(get_binary_payload_size(b"wrq,a*"), -1)
+        self.assertEqual(get_binary_payload_size(b"wcq,x,"), -1)
+
 class TestWlModemLowLevel(unittest.TestCase):
     def _make_one(self, data):
         dev = MockIODev(data)
@@ -99,6 +116,35 @@ class TestWlModemLowLevel(unittest.TestCase):
         pkt = modem.get_packet()
         self.assertIsInstance(pkt, ModemSentence)
 
+    def test_waiting_data_is_read_at_once(self):
+        modem, dev = self._make_one(b"wcv\nwrp,8,Hi\nThere\n")
+        pkt = modem.get_packet()
+        self.assertEqual(pkt.cmd, ord("v"))
+        # Everything was read from the device, the rest is kept for the next call
+        self.assertEqual(dev.in_waiting, 0)
+
+        pkt = modem.get_packet()
+        self.assertEqual(pkt.options, [b'8', b'Hi\nThere'])
+        self.assertEqual(modem.get_packet(), None)
+
+    def test_data_after_invalid_packet_is_kept(self):
+        modem, _ = self._make_one(b"wzx\nwcv\n")
+        self.assertRaises(WlProtocolParseError, modem.get_packet)
+
+        pkt = modem.get_packet()
+        self.assertIsInstance(pkt, ModemSentence)
+        self.assertEqual(pkt.cmd, ord("v"))
+
+
+    def test_wait_sentence_does_not_sleep_between_waiting_sentences(self):
+        modem, _ = self._make_one(b"wrp,8,12345678\nwrv,1,0,1\n")
+        start = time.monotonic()
+        pkt = modem.wait_sentence(CMD_GET_VERSION, timeout=5.0, sleep_time=1.0)
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(pkt.options, [b'1', b'0', b'1'])
+        # The data packet received while waiting is kept
+        self.assertEqual(modem.get_data_packet(timeout=0), b'12345678')
+
 
 class TestWlModem(unittest.TestCase):
     def _make_one(self, data):
@@ -209,8 +255,27 @@ class TestWlModem(unittest.TestCase):
         modem, _ = self._make_one(b"wrq,a\n")
         modem.payload_size = 8  # Faking that we are connected
         self.assertRaises(WlModemGenericError, modem.cmd_queue_packet, b"1234567")
-        if sys.version_info > (3, 0):
-            self.assertRaises(WlModemGenericError, modem.cmd_queue_packet, "12345678")
+        self.assertRaises(WlModemGenericError, modem.cmd_queue_packet, "12345678")
+
+    def test_cmd_flush_and_queue_packet(self):
+        modem, dev = self._make_one(b"wrf,a\nwrq,a\n")
+        modem.payload_size = 8  # Faking that we are connected
+        success = modem.cmd_flush_and_queue_packet(b"12345678")
+        self.assertTrue(success)
+        # Both commands are written before the responses are read
+        self.assertEqual(dev.out_buf, b"wcf\nwcq,8,12345678\n")
+
+    def test_cmd_flush_and_queue_packet_fails_if_flush_fails(self):
+        modem, _ = self._make_one(b"wrf,n\nwrq,a\n")
+        modem.payload_size = 8  # Faking that we are connected
+        success = modem.cmd_flush_and_queue_packet(b"12345678")
+        self.assertFalse(success)
+
+    def test_cmd_flush_and_queue_packet_without_response_does_not_crash(self):
+        modem, _ = self._make_one(b"")
+        modem.payload_size = 8  # Faking that we are connected
+        success = modem.cmd_flush_and_queue_packet(b"12345678", timeout=0.01)
+        self.assertFalse(success)
 
     def test_get_data(self):
         modem, _ = self._make_one(b"wrp,8,12345678\n")
@@ -34,6 +34,17 @@ class TestWlModemSimulator(unittest.TestCase):
         _len = modem.cmd_get_queue_length()
         self.assertEqual(_len, 0)
 
+    def test_cmd_flush_and_queue_packet_works(self):
+        modem = self._make_one()
+        modem.connect()
+        modem.cmd_queue_packet(b"12345678")
+        modem.cmd_queue_packet(b"12345678")
+        success = modem.cmd_flush_and_queue_packet(b"87654321")
+        self.assertTrue(success)
+        # Only the last packet is left in the queue
+        _len = modem.cmd_get_queue_length()
+        self.assertEqual(_len, 1)
+
     def test_cmd_diagnostic_works(self):
         modem = self._make_one()
         diag = modem.cmd_get_diagnostic()
@@ -49,7 +60,7 @@ class TestWlModemSimulator(unittest.TestCase):
         modem = self._make_one()
         modem.connect()
         modem.cmd_queue_packet(b"12345678")
-        modem._next_packet_time = time.time() + 0.01  # Don't want to wait in the unit test
+        modem._next_packet_time = time.monotonic() + 0.01  # Don't want to wait in the unit test
         # The packet is not available yet
         data = modem.get_data_packet(timeout=0.0)
         self.assertEqual(data, None)
@@ -2,7 +2,53 @@
 import unittest
 import time
 from wlmodem import WlModemSimulator
-from wlmodem.transport import frame, unframe, pad_payload, pretty_packet, WlUDPSocket
+from wlmodem.protocol import CMD_GET_BUFFER_LENGTH, CMD_QUEUE_PACKET, DIR_RESP, ModemSentence
+from wlmodem.transport import frame, unframe, pad_payload, pretty_packet, WlUDPSocket, WlUDPBase
+
+
+class CountingSimulator(WlModemSimulator):
+    """ Simulator which counts the requests made to it """
+    def __init__(self, *args, **kwargs):
+        super(CountingSimulator, self).__init__(*args, **kwargs)
+        self.requests = []
+
+    def request(self, cmd_id, options=None, timeout=0.5):
+        self.requests.append(cmd_id)
+        return super(CountingSimulator, self).request(cmd_id, options=options, timeout=timeout)
+
+
+class NoQueueLengthReplySimulator(WlModemSimulator):
+    """ Simulator which drops the replies to queue length requests """
+    def request(self, cmd_id, options=None, timeout=0.5):
+        if cmd_id == CMD_GET_BUFFER_LENGTH:
+            return None
+        return super(NoQueueLengthReplySimulator, self).request(cmd_id, options=options, timeout=timeout)
+
+
+class RefuseOnceSimulator(WlModemSimulator):
+    """ Simulator which refuses the first packet queued """
+    def __init__(self, *args, **kwargs):
+        super(RefuseOnceSimulator, self).__init__(*args, **kwargs)
+        self.refused = False
+
+    def request(self, cmd_id, options=None, timeout=0.5):
+        if cmd_id == CMD_QUEUE_PACKET and not self.refused:
+            self.refused = True
+            return ModemSentence(cmd_id, DIR_RESP, options=[b'n'])
+        return super(RefuseOnceSimulator, self).request(cmd_id, options=options, timeout=timeout)
+
+
+class BufferUDP(WlUDPBase):
+    """ WlUDPBase without a worker thread, to test the buffer handling """
+    def __init__(self, modem):
+        WlUDPBase.__init__(self, modem)
+        self.received = []
+
+    def _fill_tx_buf(self):
+        pass
+
+    def _fill_rx_buf(self, data):
+        self.received.append(data)
 
 
 class TestTransport(unittest.TestCase):
@@ -20,7 +66,7 @@ class TestTransport(unittest.TestCase):
 
     def test_frame_invalid_crc_is_detected(self):
         data = b'1'
-        framed = frame(data)
+        framed = bytearray(frame(data))
         print(pretty_packet(framed))
         # Modify the CRC to corrupt the packet
         framed[1] = 3
@@ -34,6 +80,11 @@ class TestTransport(unittest.TestCase):
             self.assertEqual(len(padded), 8, "While padding {}".format(x))
             self.assertEqual(unframe(padded), False, "While padding {}".format(x))
 
+    def test_padding_uses_empty_frames(self):
+        self.assertEqual(pad_payload(b'1234', 8), b'1234\x01\x00\x01\x00')
+        self.assertEqual(pad_payload(b'12345', 8), b'12345\x01\x00\x00')
+        self.assertEqual(pad_payload(b'12345678', 8), b'12345678')
+
     def test_cobs_empty_pading_frame_does_not_return_data(self):
         # Create a COBS empty frame
         padded = pad_payload(b'', 2)
@@ -49,14 +100,7 @@ class TestTransport(unittest.TestCase):
         data = b"There is an art, it says, or rather, a knack to flying."
         sock.send(data)
 
-        got = None
-        timeout = 1000
-        while timeout > 0:
-            got = sock.receive()
-            if got is not None:
-                break
-            timeout -= 1
-            time.sleep(0.01)
+        got = sock.receive(block=True, timeout=10)
 
         self.assertEqual(got, data)
 
@@ -110,3 +154,153 @@ class TestTransport(unittest.TestCase):
 
         # Check diagnostic has been updated
         self.assertEqual(sock.diagnostic["pkt_cnt"], 2)
+
+    def test_receive_with_timeout_returns_none(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        sock = WlUDPSocket(modem, sleep_time=0)
+        self.assertEqual(sock.receive(block=True, timeout=0.05), None)
+        sock.stop()
+
+    def test_send_wakes_worker(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        sock = WlUDPSocket(modem, sleep_time=10)
+        # Let the worker get to sleep before sending
+        time.sleep(0.2)
+        sock.send(b"123")
+        got = sock.receive(block=True, timeout=5)
+        self.assertEqual(got, b"123")
+        sock.stop()
+
+    def test_stop_does_not_wait_for_sleep_time(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        sock = WlUDPSocket(modem, sleep_time=10)
+
+        start = time.time()
+        sock.stop()
+        self.assertLess(time.time() - start, 1.0)
+        self.assertFalse(sock.worker.is_alive())
+
+    def test_unframe_accepts_bytes_and_does_not_modify_input(self):
+        framed = bytearray(frame(b'hello'))
+        framed_copy = bytearray(framed)
+        self.assertEqual(unframe(bytes(framed)), b'hello')
+        self.assertEqual(unframe(framed), b'hello')
+        self.assertEqual(framed, framed_copy)
+
+    def test_padding_longer_than_precomputed(self):
+        padded = pad_payload(b'1', 102)
+        self.assertEqual(len(padded), 102)
+        self.assertEqual(padded[-3:], b'\x01\x00\x00')
+
+    def test_idle_socket_does_not_poll_modem_queue_length(self):
+        modem = CountingSimulator(0, 0, 0)
+        modem.connect()
+        sock = WlUDPSocket(modem, sleep_time=0)
+        time.sleep(0.3)
+        sock.stop()
+        # Only the initial read of the queue length is needed when nothing is sent
+        self.assertLessEqual(modem.requests.count(CMD_GET_BUFFER_LENGTH), 1)
+
+    def test_tx_buf_is_split_into_packets(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        udp = BufferUDP(modem)
+        udp._tx_buf.extend(b"0123456789abcdefghij")
+
+        self.assertEqual(udp._get_next_tx_packet(), b"01234567")
+        self.assertEqual(udp._get_next_tx_packet(), b"89abcdef")
+        self.assertEqual(udp._tx_buf, b"ghij")
+        # The last packet is padded to the payload size
+        self.assertEqual(udp._get_next_tx_packet(), b"ghij\x01\x00\x01\x00")
+        self.assertEqual(udp._tx_buf, b"")
+
+    def test_all_frames_in_received_data_are_extracted(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        udp = BufferUDP(modem)
+        # Two datagrams, padding and the start of a third datagram in the received data
+        third = frame(b"third")
+        modem.tx_queue.append(frame(b"first") + frame(b"second") + b"\x01\x00" + third[:3])
+        udp._run_receive()
+
+        self.assertEqual(udp.received, [b"first", b"second"])
+        self.assertEqual(udp._rx_buf, third[:3])
+
+    def test_run_functions_report_if_they_did_work(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        udp = BufferUDP(modem)
+        self.assertFalse(udp._run_send())
+        self.assertFalse(udp._run_receive())
+
+        udp._tx_buf.extend(frame(b"hi"))
+        self.assertTrue(udp._run_send())
+        self.assertTrue(udp._run_receive())
+        self.assertEqual(udp.received, [b"hi"])
+
+    def test_run_send_fills_modem_queue(self):
+        modem = CountingSimulator(0, 0, 0)
+        modem.connect()
+        udp = BufferUDP(modem)
+        udp._tx_buf.extend(frame(b"0123456789abcdefghij"))
+        self.assertTrue(udp._run_send())
+        # Queued up to desired_queue_length packets with a single queue length request
+        self.assertEqual(len(modem.tx_queue), udp.desired_queue_length)
+        self.assertEqual(modem.requests.count(CMD_GET_BUFFER_LENGTH), 1)
+
+    def test_receive_queue_drops_new_datagrams_when_full(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        sock = WlUDPSocket(modem, rx_max=1, sleep_time=0)
+        sock.stop()
+        self.assertTrue(sock._fill_rx_buf(b"first"))
+        self.assertFalse(sock._fill_rx_buf(b"second"))
+        self.assertEqual(sock.receive_qsize(), 1)
+        self.assertEqual(sock.receive(), b"first")
+        self.assertEqual(sock.receive(), None)
+
+    def test_frame_split_over_received_packets_is_extracted(self):
+        modem = WlModemSimulator(0, 0, 0)
+        modem.connect()
+        udp = BufferUDP(modem)
+        framed = frame(b"0123456789abcdefghij")
+        for start in range(0, len(framed), 8):
+            modem.tx_queue.append(framed[start:start + 8])
+            udp._run_receive()
+
+        self.assertEqual(udp.received, [b"0123456789abcdefghij"])
+        self.assertEqual(udp._rx_buf, b"")
+
+    def test_pretty_packet(self):
+        self.assertEqual(pretty_packet(b"Hi\x00\x7f\x80\xff"), "[48 69 00 7f 80 ff] Hi.\x7f..")
+        self.assertEqual(pretty_packet(bytearray(b"")), "[] ")
+
+    def test_run_send_does_not_queue_when_queue_length_is_unknown(self):
+        modem = NoQueueLengthReplySimulator(0, 0, 0)
+        modem.connect()
+        # The modem queue is already full
+        modem.tx_queue.extend([b"01234567", b"89abcdef"])
+        udp = BufferUDP(modem)
+        udp._tx_buf.extend(frame(b"0123456789abcdefghij"))
+
+        self.assertFalse(udp._run_send())
+        self.assertEqual(len(modem.tx_queue), 2)
+        self.assertEqual(udp._modem_queue_length, udp.desired_queue_length)
+
+    def test_refused_packet_is_queued_again(self):
+        modem = RefuseOnceSimulator(0, 0, 0)
+        modem.connect()
+        udp = BufferUDP(modem)
+        udp._tx_buf.extend(frame(b"0123456789abcdefghij"))
+
+        self.assertFalse(udp._run_send())
+        self.assertEqual(len(modem.tx_queue), 0)
+        for _ in range(10):
+            udp._run_send()
+            while udp._run_receive():
+                pass
+
+        self.assertEqual(udp.received, [b"0123456789abcdefghij"])
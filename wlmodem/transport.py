@@ -24,60 +24,73 @@ When a full datagram is received by the modem it is put on a queue and can be re
 """
 from __future__ import division, print_function
 import threading
-try:
-    import queue
-except ImportError:
-    import Queue as queue
+import queue
 import time
-import sys
+from collections import deque
 import logging
+import platform
 from abc import abstractmethod
 from cobs import cobsr as cobs
-import crcmod
+from .crc import crc8
 
 
 # Logger
-log = logging.getLogger(__file__)
-
-# Python2 detection
-IS_PY2 = False
-if sys.version_info < (3, 0):
-    IS_PY2 = True
+log = logging.getLogger(__name__)
 
+# The cobs package silently falls back to a much slower pure Python implementation if its C extension
+# is not available. Let the user know since COBS encoding/decoding is done for every datagram.
+if not getattr(cobs, "_using_extension", True) and platform.python_implementation() == "CPython":
+    log.warning("cobs C extension not available, using the slower pure Python implementation")
 
 ### Debug
+# Translation table replacing non-printable bytes with "."
+PRINTABLE = bytes(ch if 32 <= ch <= 127 else ord(".") for ch in range(256))
+# Two digit hex for every byte value
+HEX = tuple("{:02x}".format(ch) for ch in range(256))
+
+
 def printable(ch):
-    if ch < 32:
-        return "."
-    if ch > 127:
-        return "."
-    return chr(ch)
+    return chr(PRINTABLE[ch])
 
 
 def pretty_packet(pkt):
-    _hx = " ".join("{:02x}".format(x) for x in pkt)
-    return "[{}] {}".format(_hx, "".join([printable(x) for x in pkt]))
+    _hx = " ".join(map(HEX.__getitem__, pkt))
+    return "[{}] {}".format(_hx, bytes(pkt).translate(PRINTABLE).decode("ascii"))
 
 
 FRAME_END = 0  # COBS guarantees no zeros in the payload
-if IS_PY2:
-    FRAME_END = chr(0)
-# The payload is internally checksummed by the modem, but we need to detect if a packet is dropped
-# so a simple CRC-8 is sufficient
-crc_func = crcmod.predefined.mkPredefinedCrcFun("crc-8")
+FRAME_END_BYTES = b"\x00"
+EMPTY_FRAME = b"\x01\x00"  # COBS start byte followed by a frame end
+
+# Shortest time the worker thread waits when idle, doubled up to sleep_time while it stays idle
+MIN_IDLE_TIME = 0.001
 
 
 def frame(data):
-    """ Frame data using COBS for transmission """
-    crc = crc_func(data)
-    framed = bytearray(data)
-    framed.append(crc)
-    if IS_PY2:
-        framed = bytes(framed)
-    framed = cobs.encode(framed)
-    framed = bytearray(framed)
-    framed.append(FRAME_END)
-    return framed
+    """ Frame data using COBS for transmission. Returns the framed data as bytes """
+    # The payload is internally checksummed by the modem, but we need to detect if a packet is dropped
+    # so a simple CRC-8 is sufficient
+    crc = crc8(data)
+    # bytes() does not copy data which is already bytes
+    return cobs.encode(bytes(data) + bytes((crc,))) + FRAME_END_BYTES
+
+
+def make_padding(length):
+    """
+    Create padding of the given length: (COBS) empty frames, and a frame end if the length is odd
+    """
+    return EMPTY_FRAME * (length // 2) + FRAME_END_BYTES * (length % 2)
+
+
+# Padding for every length up to the largest payload size we expect, indexed by length
+PADDING = tuple(make_padding(length) for length in range(65))
+
+
+def get_padding(length):
+    """ Get padding of the given length, precomputed if possible """
+    if length < len(PADDING):
+        return PADDING[length]
+    return make_padding(length)
 
 
 def pad_payload(data, payload_size):
@@ -87,26 +100,22 @@ def pad_payload(data, payload_size):
     send = bytearray(data)
 
     left = payload_size - len(send)
-    while left >= 2:
-        # Pad with an (COBS) empty frame
-        send.append(1)  # COBS Start byte
-        send.append(FRAME_END)
-        left = payload_size - len(send)
-    if left == 1:
-        # Pad with a frame end
-        send.append(FRAME_END)
+    if left > 0:
+        send.extend(get_padding(left))
 
     return send
 
 
 def unframe(buffer):
     """ Decode frame and return data """
-    # Remove terminating 0
+    # Remove terminating 0. Slice rather than pop so the caller's buffer is left untouched
     if buffer and buffer[-1] == 0:
-        buffer.pop()
+        buffer = buffer[:-1]
+
+    if not buffer or buffer == b"\x01":
+        # Empty frame from the padding, no need to decode it
+        return None
 
-    if IS_PY2:
-        buffer = bytes(buffer)
     try:
         decoded = cobs.decode(buffer)
     except cobs.DecodeError as err:
@@ -119,9 +128,7 @@ def unframe(buffer):
 
     expected_crc = decoded[-1]
     data = decoded[:-1]
-    data_crc = crc_func(data)
-    if IS_PY2:
-        expected_crc = ord(expected_crc)
+    data_crc = crc8(data)
     if data_crc != expected_crc:
         log.warning("CRC ERR: Sender crc: {:02x} Received data crc: {:02x}".format(expected_crc, data_crc))
         return False
@@ -136,7 +143,11 @@ class WlUDPBase(object):
     def __init__(self, modem, desired_queue_length=2, diagnostic_poll_time=0, debug=True):
         super(WlUDPBase, self).__init__()
         self._tx_buf = bytearray()
+        # Packet taken from _tx_buf which the modem did not accept, to be queued before anything else
+        self._pending_tx = None
         self._rx_buf = bytearray()
+        # Length of the start of _rx_buf which is known not to contain a FRAME_END
+        self._rx_scan_pos = 0
         # Reference to the wlmodem to use
         self.modem = modem
         # How many packets to queue in the modem at any time
@@ -149,73 +160,110 @@ class WlUDPBase(object):
         self.diagnostic_poll_time = diagnostic_poll_time
         # Timestamp for next update of diagnostic
         self._diagnostic_timeout = 0
+        # Upper bound of the number of packets queued in the modem. The queue only grows when we
+        # queue packets, so it only needs to be read from the modem when this says it is full.
+        self._modem_queue_length = desired_queue_length
 
     @property
     def payload_size(self):
         return self.modem.payload_size
 
     def _run_send(self):
-        """ Check if we need to add more data to the modem for transmission """
-        if self.modem.cmd_get_queue_length() < self.desired_queue_length:
-            # Tx queue on modem is getting low, lets add another packet
-            if len(self._tx_buf) < self.payload_size:
-                # The transmit buffer is less than the payload, let's load more data
-                self._fill_tx_buf()
-
-            # Check if we have anything to transmit
-            if self._tx_buf:
+        """ Check if we need to add more data to the modem for transmission. Returns True if a packet was queued """
+        queued = False
+        modem_queue_known = True
+        if self._modem_queue_length >= self.desired_queue_length:
+            # Modem might have transmitted packets since we last checked
+            queue_length = self.modem.cmd_get_queue_length()
+            if queue_length < 0:
+                # No reply, the queue length is unknown. Keep the upper bound and try again next time
+                modem_queue_known = False
+            else:
+                self._modem_queue_length = queue_length
+
+        # Look up the payload size once, not for every packet
+        payload_size = self.payload_size
+        while modem_queue_known and self._modem_queue_length < self.desired_queue_length:
+            # Tx queue on modem is getting low, fill it up in one go
+            send = self._pending_tx
+            if send is None:
+                if len(self._tx_buf) < payload_size:
+                    # The transmit buffer is less than the payload, let's load more data
+                    self._fill_tx_buf()
+
+                # Check if we have anything to transmit
+                if not self._tx_buf:
+                    break
                 # Get the next packet to transmit
-                send = self._get_next_tx_packet()
-                # Queue the packet
-                if self.debug:
-                    log.info("Queing packet {}".format(pretty_packet(send)))
-                self.modem.cmd_queue_packet(send)
+                send = self._get_next_tx_packet(payload_size)
+            # Queue the packet
+            if self.debug and log.isEnabledFor(logging.INFO):
+                log.info("Queing packet %s", pretty_packet(send))
+            if not self.modem.cmd_queue_packet(send):
+                # Not queued. Keep the packet and send it first next time, dropping it would corrupt the datagram
+                self._pending_tx = send
+                break
+            self._pending_tx = None
+            self._modem_queue_length += 1
+            queued = True
 
         if self.diagnostic_poll_time > 0 and time.time() > self._diagnostic_timeout:
             # Update diagnostic data if enabled and we have timed out
             self.diagnostic = self.modem.cmd_get_diagnostic()
             self._diagnostic_timeout = time.time() + self.diagnostic_poll_time
 
+        return queued
+
     def _run_receive(self):
-        """ Check if we have gotten any new data from the modem """
+        """ Check if we have gotten any new data from the modem. Returns True if a packet was received """
         received = self.modem.get_data_packet(0)
-        if received:
-            if self.debug:
-                log.info("Got packet {}".format(pretty_packet(received)))
-            self._rx_buf.extend(received)
-
-            # If we have a \0 we got a datagram
-            if self._rx_buf.find(FRAME_END) >= 0:
+        if not received:
+            return False
+        if self.debug and log.isEnabledFor(logging.INFO):
+            log.info("Got packet %s", pretty_packet(received))
+        self._rx_buf.extend(received)
+
+        # If we have a \0 we got a datagram. Skip the data already searched by earlier calls
+        idx = self._rx_buf.find(FRAME_END, self._rx_scan_pos)
+        if idx >= 0 and self.debug:
+            log.info("Got full datagram, let's decode it")
+        while idx >= 0:
+            frame = self._extract_frame_from_rx_buf(idx)
+            idx = self._rx_buf.find(FRAME_END)
+
+            # Remove the framing
+            data = unframe(frame)
+            if data is None:
+                # Fill frame only, ignore that
+                continue
+
+            if data:
+                self._fill_rx_buf(data)
+            else:
+                # Error occured
                 if self.debug:
-                    log.info("Got full datagram, let's decode it")
-                while self._rx_buf.find(FRAME_END) >= 0:
-                    frame = self._extract_frame_from_rx_buf()
-
-                    # Remove the framing
-                    data = unframe(frame)
-                    if data is None:
-                        # Fill frame only, ignore that
-                        continue
-
-                    if data:
-                        self._fill_rx_buf(data)
-                    else:
-                        # Error occured
-                        if self.debug:
-                            log.warning("MSG: Invalid")
+                    log.warning("MSG: Invalid")
+
+        # What is left is an incomplete frame
+        self._rx_scan_pos = len(self._rx_buf)
+        return True
 
     @abstractmethod
     def _fill_tx_buf(self):
         """ This function is called when _tx_buf is too short to fill a packet and more data is needed"""
 
-    def _get_next_tx_packet(self):
+    def _get_next_tx_packet(self, payload_size=None):
         """ Get next packet for modem to transmit """
-        send = self._tx_buf[:self.payload_size]
-        self._tx_buf = self._tx_buf[self.payload_size:]
+        if payload_size is None:
+            payload_size = self.payload_size
+        send = self._tx_buf[:payload_size]
+        # Trim in place instead of copying the remainder of the buffer for every packet
+        del self._tx_buf[:payload_size]
 
-        if len(send) < self.payload_size:
-            # Too little data available to fill desired payload size, we need to pad it
-            send = pad_payload(send, self.payload_size)
+        if len(send) < payload_size:
+            # Too little data available to fill desired payload size, we need to pad it.
+            # send is already a copy, so pad it in place
+            send.extend(get_padding(payload_size - len(send)))
 
         return send
 
@@ -223,15 +271,13 @@ class WlUDPBase(object):
     def _fill_rx_buf(self, data):
         """ This function is called when a full datagram is received to fill the received queue """
 
-    def _extract_frame_from_rx_buf(self):
-        idx = self._rx_buf.find(FRAME_END)
-
+    def _extract_frame_from_rx_buf(self, idx):
+        """ Extract the frame ending with the FRAME_END at index idx of _rx_buf """
         # Extract the frame
         frame = self._rx_buf[:idx]
 
-        # Remove the frame from tx_buf
-        self._rx_buf = self._rx_buf[idx:]
-        self._rx_buf.pop(0)  # Remove the FRAME_END
+        # Remove the frame and the FRAME_END from rx_buf in place
+        del self._rx_buf[:idx + 1]
         return frame
 
 
@@ -258,16 +304,26 @@ class WlUDPSocket(WlUDPBase):
 
         tx_max sets the number of datagrams to allow in the send queue
         rx_max sets the number of datagrams to allow in the receive queue
-        sleep_time sets the number of seconds before checking if the modem needs more data
+        sleep_time sets the maximum number of seconds between checking if the modem needs more data.
+        While there is no work the worker backs off exponentially to this.
         debug can be set to True to enable mode debug output
         """
         WlUDPBase.__init__(self, modem, diagnostic_poll_time=diagnostic_poll_time, desired_queue_length=desired_queue_length, debug=debug)
         self.sleep_time = sleep_time
         self._tx_queue = queue.Queue(maxsize=tx_max)
-        self._rx_queue = queue.Queue(maxsize=rx_max)
+        # Received datagrams. Only the worker thread appends, so a deque (thread-safe append/popleft)
+        # and an event to wake blocking receivers is sufficient
+        self._rx_queue = deque()
+        self._rx_max = rx_max
+        self._rx_ready = threading.Event()
+        # The last datagram framed and its framed data. Periodic messages (ie sensor data) are
+        # often repeated unchanged, in which case the framing can be reused.
+        self._last_framed = (None, None)
 
         self.run_event = threading.Event()
         self.run_event.set()
+        # Set to wake the worker thread before sleep_time has passed
+        self._wake = threading.Event()
         self.worker = threading.Thread(target=self.run, args=())
         self.worker.daemon = True
         # Start thread
@@ -281,9 +337,11 @@ class WlUDPSocket(WlUDPBase):
         """
         try:
             self._tx_queue.put(data, block=block)
-            return True
         except queue.Full:
             return False
+        # Wake the worker thread so it can start transmitting right away
+        self._wake.set()
+        return True
 
     def send_qsize(self):
         """
@@ -303,40 +361,56 @@ class WlUDPSocket(WlUDPBase):
         except queue.Empty:
             pass
 
-    def receive(self, block=False):
+    def receive(self, block=False, timeout=None):
         """ Get datagram if one is available.
         If block is True it waits until a datagram is available and returns.
+        timeout sets the maximum number of seconds to block, None waits forever.
 
-        If queue is full, return None
+        If no datagram is available, return None
         """
-        try:
-            return self._rx_queue.get(block=block)
-        except queue.Empty:
-            return None
+        deadline = None
+        if block and timeout is not None:
+            deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self._rx_queue.popleft()
+            except IndexError:
+                pass
+            if not block:
+                return None
+            # Clear before checking again so a datagram added meanwhile is not missed
+            self._rx_ready.clear()
+            if self._rx_queue:
+                continue
+            if deadline is None:
+                self._rx_ready.wait()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._rx_ready.wait(remaining)
 
     def receive_qsize(self):
         """
         Return the number of datagrams which have been receved but not read yet.
         """
-        return self._rx_queue.qsize()
+        return len(self._rx_queue)
 
     def receive_flush(self):
         """
         Flush receive queue
         """
-        try:
-            # Flush receive queue
-            while True:
-                self._rx_queue.get(block=False)
-        except queue.Empty:
-            pass
+        self._rx_queue.clear()
 
     def _fill_tx_buf(self):
         try:
             # Get data
             data = self._tx_queue.get_nowait()
             # Frame it
-            framed = frame(data)
+            last_data, framed = self._last_framed
+            if data != last_data:
+                framed = frame(data)
+                self._last_framed = (bytes(data), framed)
             # Add it to the buffer
             self._tx_buf.extend(framed)
         except queue.Empty:
@@ -345,21 +419,31 @@ class WlUDPSocket(WlUDPBase):
 
     def _fill_rx_buf(self, data):
         # Got some actual data
-        try:
-            self._rx_queue.put_nowait(data)
-            return True
-        except queue.Full:
+        if self._rx_max > 0 and len(self._rx_queue) >= self._rx_max:
             # Queue full, drop the packet
             return False
+        self._rx_queue.append(data)
+        self._rx_ready.set()
+        return True
 
     def run(self):
         """ Worker thread main function. You do not need to call this function, it is run automatically """
+        idle_time = 0
         while self.run_event.is_set():
-            self._run_send()
-            self._run_receive()
-            time.sleep(self.sleep_time)
+            # Clear before doing the work, so data sent meanwhile wakes the next wait
+            self._wake.clear()
+            sent = self._run_send()
+            received = self._run_receive()
+            if sent or received:
+                # Busy, check again right away
+                idle_time = 0
+                continue
+            # Idle, back off exponentially up to sleep_time
+            idle_time = min(max(idle_time * 2, MIN_IDLE_TIME), self.sleep_time)
+            self._wake.wait(idle_time)
 
     def stop(self):
         """ Stop worker thread """
         self.run_event.clear()
+        self._wake.set()
         self.worker.join()